@@ -1,15 +1,15 @@
 import os
 import asyncio
-import json
-from typing import Dict, Any
-from typing_extensions import TypedDict
+import atexit
+import shutil
+import httpx
+import orjson
+from typing import TypedDict, Dict, Any, Annotated
 from langchain_openai import ChatOpenAI
 from langchain_mcp_adapters.client import MultiServerMCPClient
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import ToolNode
 from langchain_core.messages import HumanMessage, AIMessage
-import subprocess
-from typing import TypedDict, Annotated
 import operator
 
 from dotenv import load_dotenv
@@ -33,11 +33,34 @@ class AppState(TypedDict):
 api_key = os.getenv("OPENAI_API_KEY")
 base_url = os.getenv("OPENAI_BASE_URL")
 
+# Resolved once at import instead of on every push
+_SHOPIFY_BIN = shutil.which("shopify") or "shopify"
+_LOCAL_THEME_DIR = os.path.join(os.getcwd(), "theme")
+_DEFAULT_THEME_DIR = "/Users/macbookair-unifynd/langgraph-workflow/shopify-theme"
+
+# One pooled HTTP/2 client shared by every LLM call so connections stay warm between turns
+shared_http = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=32, keepalive_expiry=60),
+)
+
+
+@atexit.register
+def _close_shared_http():
+    # main() closes the client itself; this covers runs that never go through main()
+    if not shared_http.is_closed:
+        try:
+            asyncio.run(shared_http.aclose())
+        except RuntimeError:
+            pass
+
+
 model = ChatOpenAI(
     model="google/gemini-2.5-pro",
     temperature=0.7,
     api_key=api_key,
     base_url=base_url,
+    http_async_client=shared_http,
 )
 
 client = MultiServerMCPClient(
@@ -70,11 +93,22 @@ async def setup_tools():
     return tools
 
 
+# Open a pooled connection to the LLM endpoint while MCP tools are discovered
+async def _warm_llm():
+    # HEAD only opens the connection; it doesn't download the model catalog
+    url = (base_url or "https://api.openai.com/v1").rstrip("/") + "/models"
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    try:
+        await shared_http.head(url, headers=headers)
+    except httpx.HTTPError as e:
+        print("⚠️ LLM connection warmup failed:", e)
+
+
 # Node: call_model
 async def call_model(state: AppState) -> AppState:
         messages = state["messages"]
         response = await model_with_tools.ainvoke(messages)
-        return {"messages": messages + [response]}
+        return {"messages": [response]}
 
 
 
@@ -84,31 +118,62 @@ def should_continue(state: AppState):
     last_message = messages[-1]
     if hasattr(last_message, "tool_calls") and last_message.tool_calls:
         return "tools"
-    return "generate_theme"
+    # Only generate a theme when the current turn actually references a Figma design
+    for msg in reversed(messages):
+        content = getattr(msg, "content", "")
+        if isinstance(content, str) and "figma.com" in content:
+            return "generate_theme"
+        if isinstance(msg, HumanMessage):
+            break
+    return END
+
+# Pull just the figma.com URL out of a message in a single pass over its content
+def _extract_figma_url(content) -> str | None:
+    if not isinstance(content, str):
+        return None
+    pre, sep, post = content.partition("figma.com")
+    if not sep:
+        return None
+    start = max(pre.rfind(ch) for ch in " \n\t(<\"'") + 1
+    end = 0
+    for ch in post:
+        if ch in " \n\t)>\"'":
+            break
+        end += 1
+    # Drop sentence punctuation that directly follows the URL
+    return (pre[start:] + sep + post[:end]).rstrip(".,;")
+
+# Static halves of the generate_theme prompt, built once at import
+_THEME_PROMPT_PREFIX = "Using the Figma design at "
+_THEME_PROMPT_SUFFIX = (
+    ", analyze the design and generate Shopify theme files in Liquid format. "
+    "Include at least templates/index.liquid, sections/hero.liquid, assets/style.css, and assets/script.js. "
+    "Do not generate React, JSX, or any non-Shopify code. "
+    "Return a JSON dictionary with file paths as keys and file contents as values. "
+    "Ensure compatibility with Shopify's theme structure. "
+    "Also include config/settings_schema.json."
+)
 
 # Node: generate_theme
 async def generate_theme(state: AppState) -> AppState:
     """Generate Shopify theme files from Figma design."""
     messages = state["messages"]
-    figma_url = next((msg.content for msg in messages if "figma.com" in msg.content), None)
+
+    # Newest message first, so the latest design URL in the conversation wins
+    figma_url = None
+    for msg in reversed(messages):
+        figma_url = _extract_figma_url(msg.content)
+        if figma_url:
+            break
 
     if not figma_url:
         error_msg = "❌ No Figma URL found in the conversation."
         print(error_msg)
-        state["messages"].append(AIMessage(content=error_msg))
-        return state
+        return {"messages": [AIMessage(content=error_msg)]}
 
-    prompt = (
-        f"Using the Figma design at {figma_url}, analyze the design and generate Shopify theme files in Liquid format. "
-        "Include at least templates/index.liquid, sections/hero.liquid, assets/style.css, and assets/script.js. "
-        "Do not generate React, JSX, or any non-Shopify code. "
-        "Return a JSON dictionary with file paths as keys and file contents as values. "
-        "Ensure compatibility with Shopify's theme structure. "
-        "Also include config/settings_schema.json."
-    )
+    prompt = f"{_THEME_PROMPT_PREFIX}{figma_url}{_THEME_PROMPT_SUFFIX}"
 
-    messages.append(HumanMessage(content=prompt))
-    response = await model_with_tools.ainvoke(messages)
+    response = await model_with_tools.ainvoke(messages + [HumanMessage(content=prompt)])
 
 
     print(f"📝 AI model raw response: {response}")
@@ -120,22 +185,23 @@ async def generate_theme(state: AppState) -> AppState:
 
             # --- 🩹 FIX: remove markdown fences if present ---
             if raw_content.startswith("```"):
-                import re
-                raw_content = re.sub(r"^```[a-zA-Z0-9]*\n", "", raw_content)
-                raw_content = re.sub(r"\n```$", "", raw_content)
+                nl = raw_content.find("\n")
+                if nl != -1:
+                    raw_content = raw_content[nl + 1:]
+                raw_content = raw_content.removesuffix("```").rstrip("\n")
 
-            theme_files = json.loads(raw_content)
+            theme_files = orjson.loads(raw_content)
 
             # Add minimal defaults if missing
             if "config/settings_schema.json" not in theme_files:
-                theme_files["config/settings_schema.json"] = json.dumps([
+                theme_files["config/settings_schema.json"] = orjson.dumps([
                     {
                         "name": "theme_info",
                         "theme_name": "Generated Theme",
                         "theme_version": "1.0.0",
                         "theme_author": "LangGraph"
                     }
-                ])
+                ]).decode()
             if "layout/theme.liquid" not in theme_files:
                 theme_files["layout/theme.liquid"] = (
                     "<!DOCTYPE html>\n"
@@ -151,58 +217,72 @@ async def generate_theme(state: AppState) -> AppState:
                     "</html>"
                 )
 
-            state["theme_files"] = theme_files
-            state["messages"].append(AIMessage(content="✅ Shopify theme files generated successfully."))
-
             # Write theme files to local disk
-            save_theme_files(theme_files)
+            await save_theme_files_async(theme_files)
 
-        except json.JSONDecodeError as e:
+            return {
+                "messages": [AIMessage(content="✅ Shopify theme files generated successfully.")],
+                "theme_files": theme_files,
+            }
+
+        except orjson.JSONDecodeError as e:
             error_msg = f"❌ Failed to parse generated theme files: {e}"
             print(error_msg)
-            state["messages"].append(AIMessage(content=error_msg))
+            return {"messages": [AIMessage(content=error_msg)]}
     else:
         error_msg = "❌ No theme files generated from Figma design. AI response was empty."
         print(error_msg)
-        state["messages"].append(AIMessage(content=error_msg))
-
-    return state
+        return {"messages": [AIMessage(content=error_msg)]}
 
 
 
 # Node to push theme to shopify
-def push_theme(state: AppState) -> AppState:
+async def push_theme(state: AppState) -> AppState:
     store_name = "trestingpqr"
-    theme_dir = os.path.join(os.getcwd(), "theme")
-    if not os.path.exists(theme_dir):
+    theme_dir = _LOCAL_THEME_DIR
+    if not os.path.isdir(theme_dir):
         print("Theme directory does not exist, using default directory")
-        theme_dir = "/Users/macbookair-unifynd/langgraph-workflow/shopify-theme"
-    cmd = ["shopify", "theme", "push", "--store", store_name]
+        theme_dir = _DEFAULT_THEME_DIR
+        if not os.path.isdir(theme_dir):
+            print(f"❌ Theme directory not found: {theme_dir}")
+            return {}
+    cmd = [_SHOPIFY_BIN, "theme", "push", "--store", store_name]
 
     try:
-        result = subprocess.Popen(cmd, cwd=theme_dir)
-        result.wait()
+        # Inherit the terminal so the CLI's theme-selection and login prompts stay visible
+        proc = await asyncio.create_subprocess_exec(*cmd, cwd=theme_dir)
+    except FileNotFoundError as e:
+        print(f"❌ Shopify CLI not found ({e.filename}), install it to push the theme")
+        return {}
+
+    returncode = await proc.wait()
+    if returncode == 0:
         print("✅ Shopify theme push succeeded")
-        print(result.stdout)
-        if result.stderr:
-            print("⚠️ Shopify CLI warnings:", result.stderr)
-    except subprocess.CalledProcessError as e:
-        print("❌ Shopify theme push failed")
-        print(e.stdout)
-        print(e.stderr)
+    else:
+        print(f"❌ Shopify theme push failed with exit code {returncode}")
 
-    return state
+    return {}
 
 # ----------------------------
 # 4. Helper: Save theme files
 # ----------------------------
-def save_theme_files(theme_files: Dict[str, str], base_dir: str = "theme"):
-    os.makedirs(base_dir, exist_ok=True)
-    for path, content in theme_files.items():
-        full_path = os.path.join(base_dir, path)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        with open(full_path, "w", encoding="utf-8") as f:
-            f.write(content)
+def _write_theme_file(full_path: str, content: str):
+    data = content.encode("utf-8")
+    with open(full_path, "wb") as f:
+        f.write(data)
+
+
+async def save_theme_files_async(theme_files: Dict[str, str], base_dir: str = _LOCAL_THEME_DIR):
+    # makedirs creates base_dir along with each parent, so it only needs its own call when there are no files
+    dirs = {os.path.dirname(os.path.join(base_dir, p)) for p in theme_files} or {base_dir}
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+
+    # Fan the writes out to worker threads so they overlap instead of running serially
+    await asyncio.gather(*(
+        asyncio.to_thread(_write_theme_file, os.path.join(base_dir, path), content)
+        for path, content in theme_files.items()
+    ))
     print(f"📂 Theme files saved to: {os.path.abspath(base_dir)}")
 
 
@@ -211,46 +291,49 @@ def save_theme_files(theme_files: Dict[str, str], base_dir: str = "theme"):
 # ----------------------------
 async def main():
     global model_with_tools
-    tools = await setup_tools()
+    try:
+        tools, _ = await asyncio.gather(setup_tools(), _warm_llm())
 
-    # Bind tools to model
-    model_with_tools = model.bind_tools(tools)
+        # Bind tools to model
+        model_with_tools = model.bind_tools(tools)
 
-    tool_node = ToolNode(tools)
+        tool_node = ToolNode(tools)
 
-    # --- Build Graph ---
-    builder = StateGraph(AppState)
-    builder.add_node("call_model", call_model)
-    builder.add_node("tools", tool_node)
-    builder.add_node("generate_theme", generate_theme)
-    builder.add_node("push_theme", push_theme)  
+        # --- Build Graph ---
+        builder = StateGraph(AppState)
+        builder.add_node("call_model", call_model)
+        builder.add_node("tools", tool_node)
+        builder.add_node("generate_theme", generate_theme)
+        builder.add_node("push_theme", push_theme)  
 
-    builder.add_edge(START, "call_model")
-    builder.add_conditional_edges("call_model", should_continue)
-    builder.add_edge("tools", "call_model")
-    builder.add_edge("generate_theme", "push_theme")
-    builder.add_edge("push_theme", END)
+        builder.add_edge(START, "call_model")
+        builder.add_conditional_edges("call_model", should_continue)
+        builder.add_edge("tools", "call_model")
+        builder.add_edge("generate_theme", "push_theme")
+        builder.add_edge("push_theme", END)
 
-    graph = builder.compile()
+        graph = builder.compile()
 
-    # --- Interactive loop ---
-    chat_history = []
+        # --- Interactive loop ---
+        chat_history = []
 
-    while True:
-        user_query = input("Enter your Query: ")
-        if user_query.lower() in ["quit", "exit", "q"]:
-            print("👋 Goodbye!")
-            break
+        while True:
+            user_query = input("Enter your Query: ")
+            if user_query.lower() in ["quit", "exit", "q"]:
+                print("👋 Goodbye!")
+                break
 
-        chat_history.append(HumanMessage(content=user_query))
+            chat_history.append(HumanMessage(content=user_query))
 
-        result = await graph.ainvoke({"messages": chat_history, "theme_files": {}})
+            result = await graph.ainvoke({"messages": chat_history, "theme_files": {}})
 
-        # Append assistant reply
-        assistant_msg = result["messages"][-1]
-        chat_history.append(assistant_msg)
+            # Append assistant reply
+            assistant_msg = result["messages"][-1]
+            chat_history.append(assistant_msg)
 
-        print("Assistant:", assistant_msg.content)
+            print("Assistant:", assistant_msg.content)
+    finally:
+        await shared_http.aclose()
 
 
 if __name__ == "__main__":
@@ -1,15 +1,16 @@
 import os
 import asyncio
-import json
-from typing import Dict, Any
-from typing_extensions import TypedDict
+import atexit
+import hashlib
+import shutil
+import httpx
+import orjson
+from typing import TypedDict, Dict, Any, Annotated
 from langchain_openai import ChatOpenAI
 from langchain_mcp_adapters.client import MultiServerMCPClient
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import ToolNode
 from langchain_core.messages import HumanMessage, AIMessage
-import subprocess
-from typing import TypedDict, Annotated
 import operator
 
 
@@ -21,6 +22,8 @@ import operator
 class AppState(TypedDict):
     messages: Annotated[list[HumanMessage | AIMessage], operator.add]
     theme_files: Dict[str, Any]
+    theme_prompt_hash: str
+    last_ai_idx: int
 
 
 # ----------------------------
@@ -30,11 +33,43 @@ class AppState(TypedDict):
 api_key = os.getenv("OPENAI_API_KEY")
 base_url = os.getenv("OPENAI_BASE_URL")
 
+# Resolved once at import instead of on every push
+_SHOPIFY_BIN = shutil.which("shopify") or "shopify"
+_LOCAL_THEME_DIR = os.path.join(os.getcwd(), "theme")
+_DEFAULT_THEME_DIR = "/Users/macbookair-unifynd/langgraph-workflow/shopify-theme"
+
+# One pooled HTTP/2 client shared by every LLM call so connections stay warm between turns
+shared_http = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=32, keepalive_expiry=60),
+)
+
+
+@atexit.register
+def _close_shared_http():
+    # main() closes the client itself; this covers runs that never go through main()
+    if not shared_http.is_closed:
+        try:
+            asyncio.run(shared_http.aclose())
+        except RuntimeError:
+            pass
+
+
 model = ChatOpenAI(
     model="moonshotai/kimi-k2:free",
     temperature=0.7,
     api_key=api_key,
     base_url=base_url,
+    http_async_client=shared_http,
+)
+
+# Shared by every generate_theme call so the HTTP client is built once
+theme_llm = ChatOpenAI(
+    model="moonshotai/kimi-k2:free",
+    temperature=0.7,
+    api_key=api_key,
+    base_url=base_url,
+    http_async_client=shared_http,
 )
 
 client = MultiServerMCPClient(
@@ -68,13 +103,25 @@ async def setup_tools():
     return tools
 
 
+# Open a pooled connection to the LLM endpoint while MCP tools are discovered
+async def _warm_llm():
+    # HEAD only opens the connection; it doesn't download the model catalog
+    url = (base_url or "https://api.openai.com/v1").rstrip("/") + "/models"
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    try:
+        await shared_http.head(url, headers=headers)
+    except httpx.HTTPError as e:
+        print("⚠️ LLM connection warmup failed:", e)
+
+
 # Node: call_model
 async def call_model(state: AppState) -> AppState:
     messages = state["messages"]
     print("\n\n🤖 Calling AI model with messages:\n\n", messages[-1])
     response = await model_with_tools.ainvoke(messages)
     print(f"\n\nn🤖 🤖 🤖 🤖 🤖 🤖 🤖AI model response in call_model🤖 🤖 🤖 🤖 🤖 🤖: {response.content}")
-    return {"messages": messages + [response]}
+    # The reducer appends response at len(messages); remember it for generate_theme
+    return {"messages": [response], "last_ai_idx": len(messages)}
 
 
 
@@ -87,33 +134,14 @@ def should_continue(state: AppState):
         return "tools"
     return "generate_theme"
 
-# Node: generate_theme
-async def generate_theme(state: AppState) -> AppState:
-
-    """Generate Shopify theme files by converting raw AI/tool output into Liquid format."""
-    messages = state["messages"]
-
-    # ✅ Get the latest AI response (after tool outputs are passed back into call_model)
-    # last_ai_msg = next((msg for msg in reversed(messages) if isinstance(msg, AIMessage)), None)
-    last_ai_msg = messages[-2]
-    last_last_msg = messages[-1]
-    print(f"📝 📝 📝 📝 📝 📝 📝 📝 📝 Latest AI message for theme generation:📝 📝 📝 📝 📝 📝 📝\n{last_ai_msg.content}")
-    print(f"📝 📝 📝 📝 📝 📝 📝 📝 📝 Last user message before theme generation:📝 📝 📝 📝 📝 📝 📝\n{last_last_msg.content}")
-    if not last_ai_msg or not last_ai_msg.content:
-        error_msg = "❌ No AI response found with theme generation content."
-        print(error_msg)
-        state["messages"].append(AIMessage(content=error_msg))
-        return state
-
-    raw_code = last_ai_msg.content.strip()
-    print(f"📝 Using latest AI content for theme generation:\n{raw_code}")
-
-    prompt = f"""
+# Static halves of the generate_theme prompt, built once at import
+_THEME_PROMPT_PREFIX = """
         You are a Shopify theme generator.
         The following is React/JSX code or structured UI markup:
 
         ---
-        {raw_code}
+        """
+_THEME_PROMPT_SUFFIX = """
         ---
 
         Convert this into a **Shopify theme** format with:
@@ -122,25 +150,49 @@ async def generate_theme(state: AppState) -> AppState:
         - Any CSS/JS into `assets/`.
 
         Return the result as valid JSON:
-        {{
+        {
           "layout/theme.liquid": "...",
           "sections/header.liquid": "...",
           "sections/footer.liquid": "...",
           "config/settings_schema.json": "...",
           "assets/style.css": "...",
           "assets/script.js": "..."
-        }}
+        }
     """
 
+# Node: generate_theme
+async def generate_theme(state: AppState) -> AppState:
+
+    """Generate Shopify theme files by converting raw AI/tool output into Liquid format."""
+    messages = state["messages"]
+
+    # ✅ Get the latest AI response (after tool outputs are passed back into call_model)
+    last_ai_idx = state.get("last_ai_idx")
+    if last_ai_idx is None:
+        last_ai_idx = next((i for i in range(len(messages) - 1, -1, -1) if isinstance(messages[i], AIMessage)), None)
+    last_ai_msg = messages[last_ai_idx] if last_ai_idx is not None else None
+    last_last_msg = messages[-1]
+    print(f"📝 📝 📝 📝 📝 📝 📝 📝 📝 Latest AI message for theme generation:📝 📝 📝 📝 📝 📝 📝\n{getattr(last_ai_msg, 'content', None)}")
+    print(f"📝 📝 📝 📝 📝 📝 📝 📝 📝 Last user message before theme generation:📝 📝 📝 📝 📝 📝 📝\n{last_last_msg.content}")
+    if not last_ai_msg or not last_ai_msg.content:
+        error_msg = "❌ No AI response found with theme generation content."
+        print(error_msg)
+        return {"messages": [AIMessage(content=error_msg)]}
+
+    raw_code = last_ai_msg.content.strip()
+    print(f"📝 Using latest AI content for theme generation:\n{raw_code}")
+
+    prompt = f"{_THEME_PROMPT_PREFIX}{raw_code}{_THEME_PROMPT_SUFFIX}"
+
+    # Skip the LLM round-trip when this exact prompt already produced theme files
+    prompt_hash = hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest()
+    if state.get("theme_files") and state.get("theme_prompt_hash") == prompt_hash:
+        print("♻️ Theme files already generated for this prompt, skipping regeneration")
+        return {}
+
     # messages.append(HumanMessage(content=prompt))
     # response = await model_with_tools.ainvoke(messages)
-    llm = ChatOpenAI(
-    model="moonshotai/kimi-k2:free",
-    temperature=0.7,
-    api_key=api_key,
-    base_url=base_url,
-    )
-    response = llm([HumanMessage(content=prompt)])
+    response = await theme_llm.ainvoke([HumanMessage(content=prompt)])
     result = response.content.strip()
 
     # print(f"📝 AI model RAW RESPONSE: {response.content}")
@@ -152,22 +204,23 @@ async def generate_theme(state: AppState) -> AppState:
 
             # --- 🩹 FIX: remove markdown fences if present ---
             if raw_content.startswith("```"):
-                import re
-                raw_content = re.sub(r"^```[a-zA-Z0-9]*\n", "", raw_content)
-                raw_content = re.sub(r"\n```$", "", raw_content)
+                nl = raw_content.find("\n")
+                if nl != -1:
+                    raw_content = raw_content[nl + 1:]
+                raw_content = raw_content.removesuffix("```").rstrip("\n")
 
-            theme_files = json.loads(raw_content)
+            theme_files = orjson.loads(raw_content)
 
             # Add minimal defaults if missing
             if "config/settings_schema.json" not in theme_files:
-                theme_files["config/settings_schema.json"] = json.dumps([
+                theme_files["config/settings_schema.json"] = orjson.dumps([
                     {
                         "name": "theme_info",
                         "theme_name": "Generated Theme",
                         "theme_version": "1.0.0",
                         "theme_author": "LangGraph"
                     }
-                ])
+                ]).decode()
             if "layout/theme.liquid" not in theme_files:
                 theme_files["layout/theme.liquid"] = (
                     "<!DOCTYPE html>\n"
@@ -183,57 +236,72 @@ async def generate_theme(state: AppState) -> AppState:
                     "</html>"
                 )
 
-            state["theme_files"] = theme_files
-            state["messages"].append(AIMessage(content="✅ Shopify theme files generated successfully."))
-
             # Write theme files to local disk
-            save_theme_files(theme_files)
+            await save_theme_files_async(theme_files)
+
+            return {
+                "messages": [AIMessage(content="✅ Shopify theme files generated successfully.")],
+                "theme_files": theme_files,
+                "theme_prompt_hash": prompt_hash,
+            }
 
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             error_msg = f"❌ Failed to parse generated theme files: {e}"
             print(error_msg)
-            state["messages"].append(AIMessage(content=error_msg))
+            return {"messages": [AIMessage(content=error_msg)]}
     else:
         error_msg = "❌ No theme files generated from Figma design. AI response was empty."
         print(error_msg)
-        state["messages"].append(AIMessage(content=error_msg))
-
-    return state
+        return {"messages": [AIMessage(content=error_msg)]}
 
 
 
 # Node to push theme to shopify
-def push_theme(state: AppState) -> AppState:
+async def push_theme(state: AppState) -> AppState:
     store_name = "trestingpqr"
-    theme_dir = os.path.join(os.getcwd(), "theme")
-    if not os.path.exists(theme_dir):
+    theme_dir = _LOCAL_THEME_DIR
+    if not os.path.isdir(theme_dir):
         print("Theme directory does not exist, using default directory")
-        theme_dir = "/Users/macbookair-unifynd/langgraph-workflow/shopify-theme"
-    cmd = ["shopify", "theme", "push", "--store", store_name]
+        theme_dir = _DEFAULT_THEME_DIR
+        if not os.path.isdir(theme_dir):
+            print(f"❌ Theme directory not found: {theme_dir}")
+            return {}
+    cmd = [_SHOPIFY_BIN, "theme", "push", "--store", store_name]
     try:
-        result = subprocess.Popen(cmd, cwd=theme_dir)
-        result.wait()
+        # Inherit the terminal so the CLI's theme-selection and login prompts stay visible
+        proc = await asyncio.create_subprocess_exec(*cmd, cwd=theme_dir)
+    except FileNotFoundError as e:
+        print(f"❌ Shopify CLI not found ({e.filename}), install it to push the theme")
+        return {}
+
+    returncode = await proc.wait()
+    if returncode == 0:
         print("✅ Shopify theme push succeeded")
-        print(result.stdout)
-        if result.stderr:
-            print("⚠️ Shopify CLI warnings:", result.stderr)
-    except subprocess.CalledProcessError as e:
-        print("❌ Shopify theme push failed")
-        print(e.stdout)
-        print(e.stderr)
+    else:
+        print(f"❌ Shopify theme push failed with exit code {returncode}")
 
-    return state
+    return {}
 
 # ----------------------------
 # 4. Helper: Save theme files
 # ----------------------------
-def save_theme_files(theme_files: Dict[str, str], base_dir: str = "theme"):
-    os.makedirs(base_dir, exist_ok=True)
-    for path, content in theme_files.items():
-        full_path = os.path.join(base_dir, path)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        with open(full_path, "w", encoding="utf-8") as f:
-            f.write(content)
+def _write_theme_file(full_path: str, content: str):
+    data = content.encode("utf-8")
+    with open(full_path, "wb") as f:
+        f.write(data)
+
+
+async def save_theme_files_async(theme_files: Dict[str, str], base_dir: str = _LOCAL_THEME_DIR):
+    # makedirs creates base_dir along with each parent, so it only needs its own call when there are no files
+    dirs = {os.path.dirname(os.path.join(base_dir, p)) for p in theme_files} or {base_dir}
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+
+    # Fan the writes out to worker threads so they overlap instead of running serially
+    await asyncio.gather(*(
+        asyncio.to_thread(_write_theme_file, os.path.join(base_dir, path), content)
+        for path, content in theme_files.items()
+    ))
     print(f"📂 Theme files saved to: {os.path.abspath(base_dir)}")
 
 
@@ -243,7 +311,7 @@ def save_theme_files(theme_files: Dict[str, str], base_dir: str = "theme"):
 # --- Build Graph for langgraph.json ---
 async def setup_graph():
     global model_with_tools
-    tools = await setup_tools()
+    tools, _ = await asyncio.gather(setup_tools(), _warm_llm())
 
     # Bind tools to model
     model_with_tools = model.bind_tools(tools)
@@ -276,28 +344,48 @@ async def setup_graph():
 
     return builder.compile()
 
-graph = asyncio.run(setup_graph())
+
+# Built on first use inside the running event loop rather than at import time
+_graph = None
+_graph_lock = asyncio.Lock()
+
+
+async def get_graph():
+    global _graph
+    async with _graph_lock:
+        if _graph is None:
+            _graph = await setup_graph()
+    return _graph
+
+
+# Graph factory referenced from langgraph.json
+async def make_graph():
+    return await get_graph()
 
 # ----------------------------
 # 6. Interactive Main (optional CLI usage)
 # ----------------------------
 async def main():
-    chat_history = []
+    try:
+        graph = await get_graph()
+        chat_history = []
 
-    while True:
-        user_query = input("Enter your Query: ")
-        if user_query.lower() in ["quit", "exit", "q"]:
-            print("👋 Goodbye!")
-            break
+        while True:
+            user_query = input("Enter your Query: ")
+            if user_query.lower() in ["quit", "exit", "q"]:
+                print("👋 Goodbye!")
+                break
 
-        chat_history.append(HumanMessage(content=user_query))
-        result = await graph.ainvoke({"messages": chat_history, "theme_files": {}})
-        print("\n\n Result from the graph : ", result)
+            chat_history.append(HumanMessage(content=user_query))
+            result = await graph.ainvoke({"messages": chat_history, "theme_files": {}})
+            print("\n\n Result from the graph : ", result)
 
-        assistant_msg = result["messages"][-1]
-        chat_history.append(assistant_msg)
+            assistant_msg = result["messages"][-1]
+            chat_history.append(assistant_msg)
 
-        print("\n\nAssistant:", assistant_msg.content)
+            print("\n\nAssistant:", assistant_msg.content)
+    finally:
+        await shared_http.aclose()
 
 
 if __name__ == "__main__":